@@ -3,8 +3,8 @@ Example 0: Simple Trace Test (No OpenAI Required)
 This is the absolute simplest test - just sends a basic trace to Databricks.
 Use this to verify your OpenTelemetry -> Databricks connection works.
 """
+import functools
 import os
-import time
 import mlflow
 
 from config import (
@@ -13,8 +13,9 @@ from config import (
     MLFLOW_EXPERIMENT_NAME_BASIC,
 )
 
+@functools.lru_cache(maxsize=1)
 def setup_mlflow():
-    """Configure MLflow to connect to Databricks"""
+    """Configure MLflow to connect to Databricks (only runs once per process)"""
     # Set environment variables BEFORE any MLflow calls
     os.environ["DATABRICKS_HOST"] = DATABRICKS_HOST
     os.environ["DATABRICKS_TOKEN"] = DATABRICKS_TOKEN
@@ -35,7 +36,6 @@ def simple_function(x: int, y: int) -> int:
     with mlflow.start_span(name="add_numbers") as span:
         span.set_attribute("x", x)
         span.set_attribute("y", y)
-        time.sleep(0.1)  # Simulate some work
         result = x + y
         span.set_attribute("result", result)
     
@@ -49,22 +49,21 @@ def multi_step_process(input_data: str) -> dict:
     # Step 1: Parse input
     with mlflow.start_span(name="parse_input") as span:
         span.set_attribute("input_length", len(input_data))
-        time.sleep(0.05)
         parsed = input_data.split()
-        span.set_attribute("word_count", len(parsed))
+        word_count = len(parsed)
+        span.set_attribute("word_count", word_count)
     
     # Step 2: Process data
     with mlflow.start_span(name="process_data") as span:
-        time.sleep(0.1)
         processed = [word.upper() for word in parsed]
-        span.set_attribute("processed_count", len(processed))
+        span.set_attribute("processed_count", word_count)
     
     # Step 3: Generate result
     with mlflow.start_span(name="generate_result") as span:
         result = {
             "original": input_data,
             "processed": processed,
-            "word_count": len(parsed)
+            "word_count": word_count
         }
         span.set_attribute("result_keys", list(result.keys()))
     
@@ -106,7 +105,6 @@ def main():
         for i in range(3):
             result = simple_function(i, i + 1)
             print(f"  Trace {i+1}: {result}")
-            time.sleep(0.2)
         print("✓ Multiple traces sent to Databricks")
     except Exception as e:
         print(f"✗ Error: {e}")
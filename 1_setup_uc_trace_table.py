@@ -13,13 +13,14 @@ Usage:
     python 3_setup_uc_trace_table.py
 """
 import os
-from dotenv import load_dotenv
 
 import mlflow
 from mlflow.exceptions import MlflowException
 from mlflow.entities import UCSchemaLocation
 from mlflow.tracing.enablement import set_experiment_trace_location
 
+from config import load_dotenv
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -94,17 +95,18 @@ def setup_uc_trace_table():
     print(f"   Schema: {UC_SCHEMA_NAME}")
     print(f"   SQL Warehouse: {SQL_WAREHOUSE_ID}")
     
-    # Create or get the experiment
+    # Get the experiment, creating it only if it doesn't exist yet
+    # (one API call in the common case where it already exists)
     print(f"\n🔧 Creating/retrieving experiment...")
-    try:
-        experiment_id = mlflow.create_experiment(name=EXPERIMENT_NAME)
-        print(f"   ✅ Created new experiment with ID: {experiment_id}")
-    except MlflowException as e:
-        experiment = mlflow.get_experiment_by_name(EXPERIMENT_NAME)
-        experiment_id = experiment.experiment_id if experiment else None
-        if experiment_id:
-            print(f"   ✅ Using existing experiment with ID: {experiment_id}")
-        else:
+    experiment = mlflow.get_experiment_by_name(EXPERIMENT_NAME)
+    if experiment:
+        experiment_id = experiment.experiment_id
+        print(f"   ✅ Using existing experiment with ID: {experiment_id}")
+    else:
+        try:
+            experiment_id = mlflow.create_experiment(name=EXPERIMENT_NAME)
+            print(f"   ✅ Created new experiment with ID: {experiment_id}")
+        except MlflowException as e:
             print(f"   ❌ Failed to create or find experiment: {e}")
             return None
     
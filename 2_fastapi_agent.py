@@ -22,19 +22,167 @@ os.environ["DATABRICKS_TOKEN"] = DATABRICKS_TOKEN
 # Use the OpenTelemetry tracer provider instead of MLflow's default tracer provider
 os.environ["MLFLOW_USE_DEFAULT_TRACER_PROVIDER"] = "false"
 
+# Export traces from background threads instead of the request path
+os.environ.setdefault("MLFLOW_ENABLE_ASYNC_LOGGING", "true")
+os.environ.setdefault("MLFLOW_ENABLE_ASYNC_TRACE_LOGGING", "true")
+
+# ============================================================
+# OpenTelemetry Setup
+# ============================================================
+# MLflow builds the global TracerProvider itself: mlflow.set_tracking_uri() in
+# lifespan resets any provider installed before it, and set_destination() then
+# installs one with MLflow's span processors. So no provider is created here;
+# spans only reach MLflow if they come from the provider MLflow installs.
+# The service is described through the standard OTel env vars instead, which
+# that provider's Resource picks up.
+os.environ.setdefault("OTEL_SERVICE_NAME", "fastapi-otel-agent")
+os.environ.setdefault("OTEL_RESOURCE_ATTRIBUTES", "service.version=1.0.0")
+
+# Head-based sampling: MLflow's provider samples root spans at this ratio and
+# children follow their parent (it wraps the ratio in a ParentBased sampler).
+# MLflow itself traces everything when this is unset; this app defaults to 10%
+os.environ.setdefault("MLFLOW_TRACE_SAMPLING_RATIO", "0.1")
+
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+
+def _add_otlp_exporter(tracer_provider):
+    """Mirror spans to an OTLP collector, if one is configured"""
+    if not (os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT") or os.getenv("OTEL_EXPORTER_OTLP_TRACES_ENDPOINT")):
+        return
+    # MLflow only exports to this endpoint itself when no trace destination is
+    # set; lifespan always sets one before calling this, so there's no duplicate
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    
+    # The batch processor queues spans and exports them on its own thread,
+    # so requests never wait on the collector
+    tracer_provider.add_span_processor(BatchSpanProcessor(
+        OTLPSpanExporter(),
+        max_queue_size=8192,
+        max_export_batch_size=512,
+        schedule_delay_millis=500,
+    ))
+
+
 # ============================================================
 # Imports
 # ============================================================
-import mlflow
+import contextlib
+import json
+import types
+from typing import Any
+
+from cachetools import TTLCache
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
-from openai import OpenAI
-from opentelemetry import trace
-from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+from fastapi.responses import StreamingResponse
+from opentelemetry.propagate import extract
+from pydantic import BaseModel
+
+# MLFLOW_DISABLED=1 runs the app with OTel spans only and never imports mlflow
+# (and its pandas/sqlalchemy dependency tree); the MLflow calls below become no-ops
+MLFLOW_DISABLED = os.getenv("MLFLOW_DISABLED") == "1"
+
+
+class _NoOpMlflowSpan:
+    """Stand-in for an MLflow span when MLflow is disabled"""
+    def set_inputs(self, inputs):
+        pass
 
-# Get OTEL tracer for manual spans
+    def set_outputs(self, outputs):
+        pass
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_status(self, status):
+        pass
+
+    def record_exception(self, exception):
+        pass
+
+
+if MLFLOW_DISABLED:
+    # Nothing else will install a provider, so the OTel spans get our own,
+    # sampled at the same ratio MLflow would use
+    provider = TracerProvider(
+        sampler=ParentBased(root=TraceIdRatioBased(float(os.environ["MLFLOW_TRACE_SAMPLING_RATIO"]))),
+    )
+    _add_otlp_exporter(provider)
+    trace.set_tracer_provider(provider)
+    
+    mlflow = types.SimpleNamespace(
+        trace=lambda func: func,
+        start_span=lambda name: contextlib.nullcontext(_NoOpMlflowSpan()),
+        get_current_active_span=lambda: None,
+    )
+else:
+    import mlflow
+
+# Get OTEL tracer for manual spans. No provider is installed yet (see above), so
+# this is a ProxyTracer; lifespan rebinds it once MLflow has installed its provider
 tracer = trace.get_tracer(__name__, "1.0.0")
 
+MODEL_NAME = "databricks-gpt-oss-120b"
+# gpt-oss spends part of its budget on reasoning before the answer, so this
+# is higher than the chat cap elsewhere; tune per deployment with CHAT_MAX_TOKENS
+MAX_TOKENS = int(os.getenv("CHAT_MAX_TOKENS", "800"))
+GATEWAY_BASE_URL = "https://1444828305810485.ai-gateway.cloud.databricks.com/mlflow/v1"
+
+# TRACE_LEVEL=DEBUG adds verbose attributes (e.g. raw query text) to custom spans
+TRACE_DEBUG = os.getenv("TRACE_LEVEL", "INFO").upper() == "DEBUG"
+
+_AUTOLOG_ENABLED = False
+
+# /chat sampling temperature; only sent when CHAT_TEMPERATURE is set, otherwise
+# the model's own default applies
+CHAT_TEMPERATURE = float(os.environ["CHAT_TEMPERATURE"]) if os.getenv("CHAT_TEMPERATURE") else None
+_CHAT_SAMPLING = {} if CHAT_TEMPERATURE is None else {"temperature": CHAT_TEMPERATURE}
+
+# Optional in-process cache of /chat answers keyed on (query, model, max_tokens,
+# temperature), so repeated questions skip the model call. Only built when
+# CHAT_TEMPERATURE=0 (deterministic answers) and CHAT_CACHE_TTL_SECONDS is set:
+# a cache hit records a trace with no OpenAI span or token usage. Handlers only
+# touch the cache between awaits, so no lock is needed on one event loop.
+_CHAT_CACHE_TTL = int(os.getenv("CHAT_CACHE_TTL_SECONDS", "0"))
+_chat_cache = (
+    TTLCache(maxsize=1024, ttl=_CHAT_CACHE_TTL)
+    if _CHAT_CACHE_TTL > 0 and CHAT_TEMPERATURE == 0
+    else None
+)
+
+# Longest input/output text stored on an MLflow span; longer payloads are
+# truncated and flagged so trace upload size stays bounded
+_MAX_SPAN_PAYLOAD = 2048
+
+
+def _cap(text):
+    """Truncate text to _MAX_SPAN_PAYLOAD characters, returning (text, truncated)."""
+    return text[:_MAX_SPAN_PAYLOAD], len(text) > _MAX_SPAN_PAYLOAD
+
+
+def _cap_span_payload(span):
+    """MLflow span processor: truncate span inputs/outputs to _MAX_SPAN_PAYLOAD
+
+    Runs on every MLflow span as it ends, so it also covers the @mlflow.trace
+    span of /chat and the completion spans recorded by autolog.
+    """
+    for kind, value, set_value in (
+        ("input", span.inputs, span.set_inputs),
+        ("output", span.outputs, span.set_outputs),
+    ):
+        if value is None:
+            continue
+        text = value if isinstance(value, str) else json.dumps(value, default=str)
+        capped, truncated = _cap(text)
+        if truncated:
+            set_value(capped)
+            span.set_attributes({f"{kind}.truncated": True, f"{kind}.full_length": len(text)})
+
+
 def _normalize_message_content(content):
     """Normalize OpenAI-compatible message content to a single string."""
     if isinstance(content, str):
@@ -51,31 +199,96 @@ def _normalize_message_content(content):
     return str(content) if content is not None else ""
 
 
+class ChatIn(BaseModel):
+    """Request body for the chat endpoints"""
+    query: str = "Hello!"
+
+
+# FastAPI 0.130+ serializes a returned model straight to JSON bytes with
+# pydantic-core (no jsonable_encoder / json.dumps pass), hence the floor in requirements.txt
+class ChatOut(BaseModel):
+    """Response body for /chat"""
+    query: str
+    answer: str
+    raw_answer_content: Any
+    model: str
+
+
 # ============================================================
 # App Lifespan - Configure MLflow at startup
 # ============================================================
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Configure MLflow and enable auto-tracing at startup"""
-    mlflow.set_tracking_uri("databricks")
-    mlflow.tracing.set_destination(
-        destination=mlflow.entities.UCSchemaLocation(
-            catalog_name=UC_CATALOG_NAME,
-            schema_name=UC_SCHEMA_NAME,
-        )
-    )
-    experiment = mlflow.set_experiment(MLFLOW_EXPERIMENT_NAME_OTEL)
+    # Imported here rather than at module top: only startup needs them
+    import httpx
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
     
-    # Enable MLflow OpenAI auto-tracing - captures model, tokens, etc. automatically
-    mlflow.openai.autolog()
+    if MLFLOW_DISABLED:
+        print("✓ MLflow disabled (MLFLOW_DISABLED=1)")
+    else:
+        mlflow.set_tracking_uri("databricks")
+        mlflow.tracing.set_destination(
+            destination=mlflow.entities.UCSchemaLocation(
+                catalog_name=UC_CATALOG_NAME,
+                schema_name=UC_SCHEMA_NAME,
+            )
+        )
+        experiment = mlflow.set_experiment(MLFLOW_EXPERIMENT_NAME_OTEL)
+        # Cap payloads where they are recorded, including autolog's full
+        # messages and completion, rather than in each handler
+        mlflow.tracing.configure(span_processors=[_cap_span_payload])
+        
+        # Enable MLflow OpenAI auto-tracing - captures model, tokens, etc. automatically
+        # autolog() re-registers its patches on every call, so only do it once
+        # per process even if the app (and its lifespan) is started again
+        global _AUTOLOG_ENABLED
+        if not _AUTOLOG_ENABLED:
+            # silent=True drops MLflow's per-call log output; trace upload already
+            # happens in the background (MLFLOW_ENABLE_ASYNC_TRACE_LOGGING above)
+            mlflow.openai.autolog(
+                log_traces=True,
+                silent=True,
+            )
+            _AUTOLOG_ENABLED = True
+        
+        # Install MLflow's provider now instead of on the first traced call
+        # (set_experiment can leave it unset until then), so the exporter and
+        # tracer below attach to the provider that is actually used
+        mlflow.tracing.enable()
+        _add_otlp_exporter(trace.get_tracer_provider())
+        
+        # The server span and custom spans must come from that provider, or MLflow
+        # drops the @mlflow.trace span parented on them. A ProxyTracer would stay
+        # bound to the previous provider if the lifespan runs again, so rebind
+        global tracer
+        tracer = trace.get_tracer(__name__, "1.0.0")
+        
+        print("✓ MLflow configured")
+        print(f"✓ Experiment ID: {experiment.experiment_id}")
+        print(f"✓ Databricks: {DATABRICKS_HOST}")
+        print("✓ OpenAI autolog enabled")
     
-    print("✓ MLflow configured")
-    print(f"✓ Experiment ID: {experiment.experiment_id}")
-    print(f"✓ Databricks: {DATABRICKS_HOST}")
-    print("✓ OpenAI autolog enabled")
+    # One shared client (and connection pool) for the lifetime of the app,
+    # so requests reuse keep-alive connections instead of a fresh TLS handshake.
+    # DefaultAsyncHttpxClient keeps the SDK's timeout and redirect defaults
+    app.state.openai = AsyncOpenAI(
+        api_key=OPENAI_API_KEY,
+        base_url=GATEWAY_BASE_URL,
+        http_client=DefaultAsyncHttpxClient(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=50, max_connections=100),
+        ),
+    )
     
-    yield
-    print("Shutting down...")
+    try:
+        yield
+    finally:
+        print("Shutting down...")
+        await app.state.openai.close()
+        # Flush any spans still queued in the batch processors; the provider
+        # itself is shut down at interpreter exit
+        trace.get_tracer_provider().force_flush()
 
 
 # ============================================================
@@ -83,8 +296,26 @@ async def lifespan(app: FastAPI):
 # ============================================================
 app = FastAPI(title="OpenTelemetry + MLflow API", lifespan=lifespan)
 
-# Enable FastAPI auto-instrumentation - creates OTEL span for each endpoint
-FastAPIInstrumentor.instrument_app(app)
+# Endpoints that get an OTEL server span. The health check is left out, and so is
+# /chat/stream: its MLflow span must outlive the handler, so it is its own root.
+_TRACED_PATHS = {"/chat"}
+
+
+@app.middleware("http")
+async def otel_server_span(request: Request, call_next):
+    """Wrap traced endpoints in a single OTEL server span"""
+    if request.url.path not in _TRACED_PATHS:
+        return await call_next(request)
+    
+    # Continue an incoming W3C trace if the caller sent one
+    with tracer.start_as_current_span(
+        f"{request.method} {request.url.path}",
+        context=extract(request.headers),
+        kind=trace.SpanKind.SERVER,
+    ) as span:
+        response = await call_next(request)
+        span.set_attribute("http.status_code", response.status_code)
+        return response
 
 
 @app.get("/")
@@ -95,59 +326,147 @@ async def root():
 
 @app.post("/chat")
 @mlflow.trace
-async def chat(request: Request):
+async def chat(request: Request, body: ChatIn) -> ChatOut:
     """Chat endpoint with combined OTEL + MLflow tracing"""
-    body = await request.json()
-    query = body.get("query", "Hello!")
+    query = body.query
+    
+    # Capture the request's trace context once and parent the custom spans on it
+    # explicitly, rather than attaching/detaching each one as the current span
+    parent_ctx = trace.set_span_in_context(trace.get_current_span())
     
     # OTEL Signal 1: Custom span for query preprocessing
-    with tracer.start_as_current_span("query_preprocessing") as prep_span:
-        prep_span.set_attribute("query.original", query)
-        prep_span.set_attribute("query.length", len(query))
-        prep_span.set_attribute("query.word_count", len(query.split()))
+    prep_span = tracer.start_span("query_preprocessing", context=parent_ctx)
+    try:
+        prep_span.set_attributes({
+            "query.length": len(query),
+            "query.word_count": len(query.split()),
+        })
+        # The raw query is already the MLflow span input; only duplicate it here when debugging
+        if TRACE_DEBUG:
+            prep_span.set_attribute("query.original", query)
         
         # Add an OTEL event to mark preprocessing complete
         prep_span.add_event("preprocessing_complete", {
             "sanitized": True,
             "language_detected": "en"
         })
+    finally:
+        prep_span.end()
     
-    # OpenAI call - automatically traced by mlflow.openai.autolog()
-    client = OpenAI(api_key=OPENAI_API_KEY,
-                      base_url="https://1444828305810485.ai-gateway.cloud.databricks.com/mlflow/v1")
-    response = client.chat.completions.create(
-        model="databricks-gpt-oss-120b",
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": query}
-        ],
-        max_tokens=800
-    )
+    cache_key = (query, MODEL_NAME, MAX_TOKENS, CHAT_TEMPERATURE)
+    raw_content = _chat_cache.get(cache_key) if _chat_cache is not None else None
+    cache_hit = raw_content is not None
+    mlflow_span = mlflow.get_current_active_span()
+    if mlflow_span is not None:
+        mlflow_span.set_attribute("cache_hit", cache_hit)
+    
+    if not cache_hit:
+        # OpenAI call - automatically traced by mlflow.openai.autolog()
+        # Awaited so the event loop keeps serving other requests during the model call
+        client = request.app.state.openai
+        response = await client.chat.completions.create(
+            model=MODEL_NAME,
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant."},
+                {"role": "user", "content": query}
+            ],
+            max_tokens=MAX_TOKENS,
+            **_CHAT_SAMPLING,
+        )
+        raw_content = response.choices[0].message.content
+        if _chat_cache is not None and raw_content is not None:
+            _chat_cache[cache_key] = raw_content
     
-    raw_content = response.choices[0].message.content
     answer = _normalize_message_content(raw_content)
     
     # OTEL Signal 2: Custom span for response postprocessing
-    with tracer.start_as_current_span("response_postprocessing") as post_span:
-        post_span.set_attribute("response.length", len(answer))
-        post_span.set_attribute("response.word_count", len(answer.split()))
+    post_span = tracer.start_span("response_postprocessing", context=parent_ctx)
+    try:
+        post_span.set_attributes({
+            "response.length": len(answer),
+            "response.word_count": len(answer.split()),
+        })
         
         # Add event with timing info
         post_span.add_event("postprocessing_complete", {
             "truncated": False,
             "formatted": True
         })
+    finally:
+        post_span.end()
+    
+    return ChatOut(
+        query=query,
+        answer=answer,
+        raw_answer_content=raw_content,
+        model=MODEL_NAME,
+    )
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: Request, body: ChatIn):
+    """Chat endpoint that streams the answer as server-sent events"""
+    query = body.query
+    client = request.app.state.openai
+    
+    async def event_stream():
+        # The trace lives inside the generator so it stays open until the
+        # last chunk has been sent, not just until the handler returns
+        with mlflow.start_span(name="chat_stream") as mlflow_span:
+            mlflow_span.set_inputs(query)
+            parent_ctx = trace.set_span_in_context(trace.get_current_span())
+            
+            stream_span = tracer.start_span("response_streaming", context=parent_ctx)
+            chunks = []
+            try:
+                stream = await client.chat.completions.create(
+                    model=MODEL_NAME,
+                    messages=[
+                        {"role": "system", "content": "You are a helpful assistant."},
+                        {"role": "user", "content": query}
+                    ],
+                    max_tokens=MAX_TOKENS,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                )
+                async for chunk in stream:
+                    # The final chunk carries usage and no choices
+                    usage = chunk.usage
+                    if usage is not None:
+                        stream_span.set_attributes({
+                            "tokens": usage.total_tokens,
+                            "prompt_tokens": usage.prompt_tokens,
+                            "completion_tokens": usage.completion_tokens,
+                        })
+                    if not chunk.choices:
+                        continue
+                    # gpt-oss can send list-shaped content blocks here too
+                    delta = _normalize_message_content(chunk.choices[0].delta.content)
+                    if not delta:
+                        continue
+                    if not chunks:
+                        # Time-to-first-token is the gap between span start and this event
+                        stream_span.add_event("first_token")
+                    chunks.append(delta)
+                    yield f"data: {json.dumps(delta)}\n\n"
+            except Exception as exc:
+                # The 200 headers are already sent, so report the failure in-stream
+                stream_span.record_exception(exc)
+                stream_span.set_status(trace.Status(trace.StatusCode.ERROR, str(exc)))
+                mlflow_span.record_exception(exc)
+                mlflow_span.set_status("ERROR")
+                yield f"event: error\ndata: {json.dumps(str(exc))}\n\n"
+            finally:
+                stream_span.end()
+            
+            mlflow_span.set_outputs("".join(chunks))
+        yield "data: [DONE]\n\n"
     
-    return {
-        "query": query,
-        "answer": answer,
-        "raw_answer_content": raw_content,
-        "model": "databricks-gpt-oss-120b",
-    }
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
 
 
 if __name__ == "__main__":
     import uvicorn
     print("OpenTelemetry + MLflow FastAPI Agent")
-    print("Using: FastAPIInstrumentor + mlflow.openai.autolog()")
+    print("Using: OTEL server-span middleware + mlflow.openai.autolog()")
     uvicorn.run(app, host="0.0.0.0", port=8000)
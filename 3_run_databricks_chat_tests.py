@@ -17,6 +17,7 @@ This script exercises only:
 - /chat – simple Q&A about Databricks / MLflow / OpenTelemetry
 """
 
+import asyncio
 import json
 from typing import List
 
@@ -60,15 +61,29 @@ def pretty_print_response(title: str, response: httpx.Response) -> None:
         print(json.dumps(data, indent=2)[:1000])
 
 
-def main() -> None:
+# Cap on in-flight /chat requests, so a single-worker server isn't flooded
+MAX_CONCURRENCY = 5
+
+
+async def post_chat(client: httpx.AsyncClient, semaphore: asyncio.Semaphore, query: str) -> httpx.Response:
+    """POST one query to /chat, waiting for a free concurrency slot first."""
+    async with semaphore:
+        return await client.post(f"{BASE_URL}/chat", json={"query": query})
+
+
+async def main() -> None:
     print("=" * 60)
     print("Running Databricks chat test suite against FastAPI app")
     print("=" * 60)
 
-    with httpx.Client(timeout=30.0) as client:
+    async with httpx.AsyncClient(
+        timeout=60.0,
+        http2=True,
+        limits=httpx.Limits(max_connections=16),
+    ) as client:
         # Health check
         try:
-            health = client.get(f"{BASE_URL}/")
+            health = await client.get(f"{BASE_URL}/")
             print("\n--- Health check ---")
             print(f"Status: {health.status_code}")
             print(health.text[:200])
@@ -76,16 +91,17 @@ def main() -> None:
             print(f"Health check failed: {e}")
             return
 
-        # /chat tests only
-        for i, query in enumerate(CHAT_QUERIES, 1):
-            try:
-                resp = client.post(
-                    f"{BASE_URL}/chat",
-                    json={"query": query},
-                )
+        # /chat tests only - sent concurrently, printed in query order
+        semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+        responses = await asyncio.gather(
+            *(post_chat(client, semaphore, query) for query in CHAT_QUERIES),
+            return_exceptions=True,
+        )
+        for i, (query, resp) in enumerate(zip(CHAT_QUERIES, responses), 1):
+            if isinstance(resp, Exception):
+                print(f"Chat {i} failed: {resp}")
+            else:
                 pretty_print_response(f"Chat {i}: {query}", resp)
-            except Exception as e:
-                print(f"Chat {i} failed: {e}")
 
     print("\n" + "=" * 60)
     print("Databricks chat test suite complete.")
@@ -94,6 +110,6 @@ def main() -> None:
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
 
 
@@ -24,9 +24,15 @@ from config import (
 os.environ["DATABRICKS_HOST"] = DATABRICKS_HOST
 os.environ["DATABRICKS_TOKEN"] = DATABRICKS_TOKEN
 
+# Export traces from a background thread instead of the request path
+os.environ.setdefault("MLFLOW_ENABLE_ASYNC_TRACE_LOGGING", "true")
+
 MODEL_NAME = "databricks-gpt-oss-120b"
 GATEWAY_BASE_URL = "https://1444828305810485.ai-gateway.cloud.databricks.com/mlflow/v1"
 
+# Set once mlflow.openai.autolog() has patched the OpenAI client in this process.
+_AUTOLOG_ENABLED = False
+
 
 def _normalize_message_content(content: object) -> str:
     """Normalize OpenAI-compatible message content to a single string."""
@@ -55,8 +61,15 @@ async def lifespan(app: FastAPI):
     )
     experiment = mlflow.set_experiment(MLFLOW_EXPERIMENT_NAME_OTEL)
 
-    # Native MLflow OpenAI autologging (no OTEL required).
-    mlflow.openai.autolog()
+    # Native MLflow OpenAI autologging (no OTEL required). Skipped when the
+    # lifespan runs again in the same process, so the client isn't re-patched.
+    global _AUTOLOG_ENABLED
+    if not _AUTOLOG_ENABLED:
+        mlflow.openai.autolog(
+            log_traces=True,
+            silent=True,
+        )
+        _AUTOLOG_ENABLED = True
 
     print("✓ MLflow configured")
     print(f"✓ Experiment ID: {experiment.experiment_id}")
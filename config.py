@@ -2,63 +2,125 @@
 Configuration for OpenTelemetry MLflow Integration Demo
 Copy this file and set your actual credentials.
 """
+import functools
 import os
-from dotenv import load_dotenv
+import pathlib
+import re
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import ClassVar
 
-# Load environment variables from .env file
-load_dotenv()
+# .env is expected next to this file (where env_template.txt tells you to create it)
+_ENV_FILE = pathlib.Path(__file__).with_name(".env")
 
-# Databricks Configuration
-DATABRICKS_HOST = os.getenv("DATABRICKS_HOST", "https://your-workspace.cloud.databricks.com")
-DATABRICKS_TOKEN = os.getenv("DATABRICKS_TOKEN", "")
+# A value in single quotes, or in double quotes with backslash escapes inside
+_QUOTED = re.compile(r"'([^']*)'|\"((?:[^\"\\]|\\.)*)\"")
 
+# Setting name -> default used when it isn't in the environment / .env file
+_DEFAULTS = {
+    # Databricks Configuration
+    "DATABRICKS_HOST": "https://your-workspace.cloud.databricks.com",
+    "DATABRICKS_TOKEN": "",
 
-# MLflow Configuration
-MLFLOW_TRACKING_URI = os.getenv("MLFLOW_TRACKING_URI", DATABRICKS_HOST)
+    # MLflow Configuration (tracking URI falls back to DATABRICKS_HOST)
+    "MLFLOW_TRACKING_URI": None,
 
-# Separate experiment names for basic scripts vs FastAPI+OTel example
-MLFLOW_EXPERIMENT_NAME_BASIC = os.getenv(
-    "MLFLOW_EXPERIMENT_NAME_BASIC",
-    "/Users/your.email@company.com/otel-tracing-basic",
-)
-MLFLOW_EXPERIMENT_NAME_OTEL = os.getenv(
-    "MLFLOW_EXPERIMENT_NAME_OTEL",
-    "/Workspace/Users/your.email@databricks.com/otel-tracing-otel",
-)
+    # Separate experiment names for basic scripts vs FastAPI+OTel example
+    "MLFLOW_EXPERIMENT_NAME_BASIC": "/Users/your.email@company.com/otel-tracing-basic",
+    "MLFLOW_EXPERIMENT_NAME_OTEL": "/Workspace/Users/your.email@databricks.com/otel-tracing-otel",
 
+    "MLFLOW_TRACING_SQL_WAREHOUSE_ID": "tttttttt336",
+    "UC_CATALOG_NAME": "my_catalog",
+    "UC_SCHEMA_NAME": "my_schema",
 
-MLFLOW_TRACING_SQL_WAREHOUSE_ID = os.getenv(
-    "MLFLOW_TRACING_SQL_WAREHOUSE_ID",
-    "tttttttt336",
-)
-UC_CATALOG_NAME = os.getenv(
-    "UC_CATALOG_NAME",
-    "my_catalog",
-)
-UC_SCHEMA_NAME = os.getenv(
-    "UC_SCHEMA_NAME",
-    "my_schema",
-)
+    # OpenAI Configuration
+    "OPENAI_API_KEY": "",
+}
 
 
-# OpenAI Configuration
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+def load_dotenv(path=_ENV_FILE):
+    """Load KEY=VALUE lines from a .env file without overriding the environment
 
-# Validate required configuration
-def validate_config():
-    """Validate that required configuration is set"""
-    errors = []
-    
-    if not DATABRICKS_TOKEN:
-        errors.append("DATABRICKS_TOKEN is not set")
-    
-    if "your-workspace" in DATABRICKS_HOST:
-        errors.append("DATABRICKS_HOST needs to be set to your actual workspace")
-    
-    if not OPENAI_API_KEY:
-        errors.append("OPENAI_API_KEY is not set (only needed for OpenAI examples)")
-    
-    return errors
+    Handles the common python-dotenv forms: an optional leading ``export``,
+    values in single or double quotes (with backslash-escaped quotes inside
+    double quotes), and `` # ...`` comments after an unquoted value. Lines
+    with an empty key are skipped. Variable expansion and multi-line values
+    are not supported.
+    """
+    path = pathlib.Path(path)
+    if not path.is_file():
+        return
+    for line in path.read_text(encoding="utf-8").splitlines():
+        line = line.strip()
+        if line.startswith("export "):
+            line = line[len("export "):].lstrip()
+        if not line or line.startswith("#") or "=" not in line:
+            continue
+        key, value = line.split("=", 1)
+        key = key.strip()
+        if not key:
+            continue
+        value = value.strip()
+        match = _QUOTED.match(value)
+        if match:
+            single, double = match.groups()
+            value = single if single is not None else re.sub(r'\\(["\\])', r"\1", double)
+        else:
+            value = value.split(" #", 1)[0].rstrip()
+        os.environ.setdefault(key, value)
+
+
+@functools.lru_cache(maxsize=1)
+def _load():
+    """Load the .env file once and snapshot all settings in a single pass"""
+    # Always read .env: it also carries settings the apps read straight from
+    # os.environ (sampling ratio, token caps, ...). Real env vars still win
+    load_dotenv()
+    values = {key: os.environ.get(key, default) for key, default in _DEFAULTS.items()}
+    if values["MLFLOW_TRACKING_URI"] is None:
+        values["MLFLOW_TRACKING_URI"] = values["DATABRICKS_HOST"]
+    return MappingProxyType(values)
+
+
+@dataclass(frozen=True, slots=True)
+class Config:
+    """Immutable snapshot of all settings, built once at import"""
+    databricks_host: str
+    databricks_token: str
+    mlflow_tracking_uri: str
+    mlflow_experiment_name_basic: str
+    mlflow_experiment_name_otel: str
+    mlflow_tracing_sql_warehouse_id: str
+    uc_catalog_name: str
+    uc_schema_name: str
+    openai_api_key: str
 
+    # Validation rules: (attribute, predicate that flags a problem, error message)
+    RULES: ClassVar[tuple] = (
+        ("databricks_token", lambda value: not value, "DATABRICKS_TOKEN is not set"),
+        ("databricks_host", lambda value: "your-workspace" in value,
+         "DATABRICKS_HOST needs to be set to your actual workspace"),
+        ("openai_api_key", lambda value: not value,
+         "OPENAI_API_KEY is not set (only needed for OpenAI examples)"),
+    )
 
 
+CONFIG = Config(**{key.lower(): value for key, value in _load().items()})
+
+
+def __getattr__(name):
+    """Expose settings as module attributes, e.g. `from config import DATABRICKS_HOST`"""
+    if name in _DEFAULTS:
+        return getattr(CONFIG, name.lower())
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Validate required configuration
+@functools.cache
+def validate_config():
+    """Validate that required configuration is set (CONFIG is frozen, so checked once)"""
+    return tuple(
+        message
+        for attr, is_invalid, message in Config.RULES
+        if is_invalid(getattr(CONFIG, attr))
+    )
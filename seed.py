@@ -9,6 +9,7 @@ References:
 - https://docs.databricks.com/aws/en/mlflow3/genai/tracing/prod-tracing-external
 """
 import os
+from types import MappingProxyType
 
 from config import (
     DATABRICKS_HOST,
@@ -20,122 +21,263 @@ from config import (
     UC_SCHEMA_NAME
 )
 
-# Configure Databricks connection
+# Configure Databricks connection (read by the Databricks SDK for auth);
+# the tracking URI and experiment are passed to MLflow directly in
+# _configure_mlflow rather than through the environment
 os.environ["DATABRICKS_HOST"] = DATABRICKS_HOST
 os.environ["DATABRICKS_TOKEN"] = DATABRICKS_TOKEN
-os.environ["MLFLOW_TRACKING_URI"] = "databricks"
-os.environ["MLFLOW_EXPERIMENT_NAME"] = MLFLOW_EXPERIMENT_NAME_OTEL
 
-# Tell MLflow to use our OpenTelemetry TracerProvider
+# Keep MLflow's spans on the global OpenTelemetry provider rather than a
+# private one, so the OTel spans below land in the same traces
 os.environ["MLFLOW_USE_DEFAULT_TRACER_PROVIDER"] = "false"
 
 # ============================================================
 # OpenTelemetry Setup
 # ============================================================
-from opentelemetry import trace
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.resources import Resource, SERVICE_NAME
+# That global provider is created by MLflow during _configure_mlflow (setting
+# the tracking URI discards any provider installed earlier), so none is set up
+# here. The service's Resource attributes are passed through the standard OTel
+# env vars, which MLflow's provider reads.
+os.environ.setdefault("OTEL_SERVICE_NAME", "fastapi-otel-agent")
+os.environ.setdefault("OTEL_RESOURCE_ATTRIBUTES", "service.version=1.0.0,deployment.environment=development")
 
-# Create service resource
-resource = Resource(attributes={
-    SERVICE_NAME: "fastapi-otel-agent",
-    "service.version": "1.0.0",
-    "deployment.environment": "development",
-})
+# Share of /chat requests that get a trace. MLflow's provider applies it to
+# each new trace (and traces every request if it is unset), so sampling is
+# configured here rather than with an OTel sampler
+os.environ.setdefault("MLFLOW_TRACE_SAMPLING_RATIO", "0.1")
 
-# Set up TracerProvider
-provider = TracerProvider(resource=resource)
-trace.set_tracer_provider(provider)
+from opentelemetry import trace
+from opentelemetry.sdk.trace.export import BatchSpanProcessor
 
-# Get tracer for manual spans
+# Tracer for manual spans; rebound to MLflow's provider once _configure_mlflow
+# has installed it
 tracer = trace.get_tracer(__name__, "1.0.0")
 
+# Query/answer text past this many characters is left off the span (the span
+# records that it was cut, and the full length), keeping trace rows small
+_MAX_SPAN_PAYLOAD = 2048
+
+
+# System prompt shared by every request; only the user message is built per call.
+# A read-only mapping, so the one shared object can't be mutated between requests
+_SYSTEM_MSG = (MappingProxyType({"role": "system", "content": "You are a helpful assistant."}),)
+
+# Fixed completion arguments, built once; each call adds only its messages
+_REQ_TEMPLATE = {"model": "databricks-gpt-5-2", "max_tokens": 150}
+
+
+def _cap(text):
+    """Return text cut to _MAX_SPAN_PAYLOAD characters and whether anything was cut."""
+    return text[:_MAX_SPAN_PAYLOAD], len(text) > _MAX_SPAN_PAYLOAD
+
+
 # ============================================================
 # FastAPI + MLflow
 # ============================================================
-import mlflow
+# mlflow and openai are imported lazily (openai in lifespan, mlflow in
+# _configure_mlflow on a worker thread) so that importing this module, and
+# forking workers, doesn't pay for them up front.
+import asyncio
+import contextlib
+import json
+import logging
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request
-from openai import OpenAI
+from typing import TYPE_CHECKING
+
+from fastapi import FastAPI, Request, Response
+from pydantic import BaseModel
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+# Root handler at the default WARNING level (so httpx doesn't log every
+# OpenAI request); only this module's startup/shutdown lines are at INFO
+logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger("fastapi-otel-agent")
+logger.setLevel(logging.INFO)
+
+
+def _configure_mlflow():
+    """Import and configure MLflow (blocking; runs in a worker thread)"""
+    global tracer, _ROOT_BODY
+    import mlflow
+    from mlflow.tracing.utils import environment as mlflow_trace_env
+    
+    # MLflow stamps traces with git commit/branch/repo metadata, resolved with
+    # GitPython when its span processor is created. That is meaningless for a
+    # deployed container and slows startup, so skip it
+    if hasattr(mlflow_trace_env, "_resolve_git_metadata"):
+        mlflow_trace_env._resolve_git_metadata = lambda: {}
+    
+    # These calls stay sequential: each one reads or resets the trace
+    # destination / tracer provider state left by the previous call, so
+    # running them concurrently would race. The whole function is already
+    # off the event loop and overlaps with server startup (see lifespan).
+    try:
+        mlflow.set_tracking_uri("databricks")
+        
+        mlflow.tracing.set_destination(
+            destination=mlflow.entities.UCSchemaLocation(
+                catalog_name=UC_CATALOG_NAME,
+                schema_name=UC_SCHEMA_NAME,
+            )
+        )
+        experiment = mlflow.set_experiment(MLFLOW_EXPERIMENT_NAME_OTEL)
+    except Exception:
+        # Don't leave a half-configured provider exporting to a broken destination
+        mlflow.tracing.disable()
+        raise
+    # Build MLflow's tracer provider now rather than lazily on the first span,
+    # and take the tracer from it
+    mlflow.tracing.enable()
+    tracer = trace.get_tracer(__name__, "1.0.0")
+    
+    # Extra OTLP export goes on that provider, after MLflow's own processors.
+    # MLflow only exports to OTLP itself when no destination is set, and one
+    # always is above, so spans aren't sent twice
+    if os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT") or os.getenv("OTEL_EXPORTER_OTLP_TRACES_ENDPOINT"):
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        
+        # Spans wait in the batch queue and leave on the processor's own thread
+        trace.get_tracer_provider().add_span_processor(BatchSpanProcessor(
+            OTLPSpanExporter(),
+            max_queue_size=2048,
+            max_export_batch_size=512,
+            schedule_delay_millis=5000,
+        ))
+    
+    # The global provider is now MLflow's and stays put until the next setup
+    _ROOT_BODY = _encode_root_body()
+    logger.info("MLflow ready experiment=%s", experiment.experiment_id)
+
+
+async def _setup_mlflow():
+    """Run _configure_mlflow off the event loop; on failure, log it and serve untraced"""
+    try:
+        await asyncio.to_thread(_configure_mlflow)
+    except Exception:
+        logger.exception("MLflow setup failed; /chat will run without tracing")
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Configure MLflow at startup"""
-    mlflow.set_tracking_uri("databricks")
+    from openai import AsyncOpenAI
     
-    mlflow.tracing.set_destination(
-    destination=mlflow.entities.UCSchemaLocation(
-        catalog_name=UC_CATALOG_NAME,
-        schema_name=UC_SCHEMA_NAME,
-    )
-)
-    experiment = mlflow.set_experiment(MLFLOW_EXPERIMENT_NAME_OTEL)
+    # MLflow setup runs in the background while the server starts accepting
+    # connections; /chat awaits this task before creating any spans. Nothing
+    # may open a span before it finishes (e.g. ASGI instrumentation), since
+    # spans from before MLflow's provider exists never reach MLflow.
+    app.state.mlflow_ready = asyncio.create_task(_setup_mlflow())
     
-    print("✓ OpenTelemetry TracerProvider configured")
-    print(f"✓ Service: fastapi-otel-agent v1.0.0")
-    print(f"✓ Databricks: {DATABRICKS_HOST}")
-    print(f"✓ Experiment ID: {experiment.experiment_id}")
+    # One client (and connection pool) shared by all requests
+    app.state.openai = AsyncOpenAI(api_key=OPENAI_API_KEY,
+                                   base_url="https://1444828305810485.ai-gateway.cloud.databricks.com/mlflow/v1")
     
-    yield
-    print("Shutting down...")
+    logger.info("started service=fastapi-otel-agent v1.0.0 host=%s", DATABRICKS_HOST)
+    
+    try:
+        yield
+    finally:
+        logger.info("shutting down")
+        # Shutting down mid-setup: drop the task rather than leave it pending
+        # (the worker thread itself can't be interrupted and finishes on its own)
+        app.state.mlflow_ready.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await app.state.mlflow_ready
+        await app.state.openai.close()
+        # Push out whatever the batch processors still hold; MLflow's provider
+        # is shut down at interpreter exit
+        tracer_provider = trace.get_tracer_provider()
+        if hasattr(tracer_provider, "force_flush"):
+            tracer_provider.force_flush()
 
 
 app = FastAPI(title="OpenTelemetry + MLflow API", lifespan=lifespan)
 
 
+class ChatIn(BaseModel):
+    """Request body for /chat"""
+    query: str = "Hello!"
+
+
+# Returned as a model: FastAPI 0.130+ (see requirements.txt) writes it to JSON
+# bytes with pydantic-core directly, with no json.dumps round trip
+class ChatOut(BaseModel):
+    """Response body for /chat"""
+    query: str
+    answer: str
+    model: str
+
+
+def _encode_root_body():
+    """Serialize the health check body for the current global tracer provider"""
+    return json.dumps({"status": "ok", "otel_provider": str(trace.get_tracer_provider())}).encode()
+
+
+# The health check body only changes when MLflow installs its provider, so it
+# is serialized here and again at the end of _configure_mlflow, not per request
+_ROOT_BODY = _encode_root_body()
+
+
 @app.get("/")
 async def root():
     """Health check"""
-    return {
-        "status": "ok",
-        "otel_provider": str(trace.get_tracer_provider()),
-    }
+    return Response(_ROOT_BODY, media_type="application/json")
 
 
-def process_chat(query: str) -> str:
-    """Process chat with OpenTelemetry and MLflow spans"""
-    # MLflow span for Databricks - set input/output directly
-    with mlflow.start_span(name="chat_completion") as mlflow_span:
-        mlflow_span.set_inputs(query)
+async def process_chat(query: str, client: "AsyncOpenAI") -> str:
+    """Process chat with a single OpenTelemetry span exported to MLflow"""
+    # With MLFLOW_USE_DEFAULT_TRACER_PROVIDER=false the global provider is
+    # MLflow's, so one OTel span carrying the mlflow.span* attributes shows up
+    # in Databricks with its inputs/outputs - no separate MLflow span needed
+    with tracer.start_as_current_span("chat_completion") as span:
+        capped_query, truncated = _cap(query)
+        span.set_attributes({
+            "mlflow.spanInputs": json.dumps(capped_query),
+            "input.truncated": truncated,
+            "input.full_length": len(query),
+            "model": _REQ_TEMPLATE["model"],
+        })
         
-        # OpenTelemetry span for detailed tracing
-        with tracer.start_as_current_span("openai_completion") as otel_span:
-            otel_span.set_attribute("model", "databricks-gpt-5-2")
-            
-            client = OpenAI(api_key=OPENAI_API_KEY,
-                              base_url="https://1444828305810485.ai-gateway.cloud.databricks.com/mlflow/v1")
-            response = client.chat.completions.create(
-                model="databricks-gpt-5-2",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant."},
-                    {"role": "user", "content": query}
-                ],
-                max_tokens=150
-            )
-            
-            otel_span.set_attribute("tokens", response.usage.total_tokens)
+        response = await client.chat.completions.create(
+            **_REQ_TEMPLATE,
+            messages=_SYSTEM_MSG + ({"role": "user", "content": query},),
+        )
         
-        answer = response.choices[0].message.content
-        mlflow_span.set_outputs(answer)
+        usage = response.usage
+        choice = response.choices[0]
+        # content is None when a reasoning model spends the whole token cap
+        answer = choice.message.content or ""
+        if not answer and choice.finish_reason == "length":
+            span.set_attribute("output.empty_at_token_cap", True)
+            logger.warning("empty answer: model used the whole max_tokens=%d cap", _REQ_TEMPLATE["max_tokens"])
+        capped_answer, truncated = _cap(answer)
+        span.set_attributes({
+            "tokens": usage.total_tokens,
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+            "mlflow.spanOutputs": json.dumps(capped_answer),
+            "output.truncated": truncated,
+            "output.full_length": len(answer),
+        })
     
     return answer
 
 
 @app.post("/chat")
-async def chat(request: Request):
+async def chat(request: Request, body: ChatIn) -> ChatOut:
     """Chat endpoint"""
-    body = await request.json()
-    query = body.get("query", "Hello!")
-    answer = process_chat(query)
-    return {
-        "query": query,
-        "answer": answer,
-        "model": "gpt-4o-mini",
-    }
+    query = body.query
+    # Only waits on the first requests, until MLflow setup has finished
+    # (or failed, which _setup_mlflow has already logged)
+    await request.app.state.mlflow_ready
+    answer = await process_chat(query, request.app.state.openai)
+    return ChatOut(query=query, answer=answer, model=_REQ_TEMPLATE["model"])
 
 if __name__ == "__main__":
     import uvicorn
-    print("OpenTelemetry + MLflow FastAPI Agent")
-    print("Using: TracerProvider, manual OTel spans, MLflow spans")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # More than one worker needs the app as an import string. uvicorn's default
+    # loop/http settings already use uvloop + httptools when they're installed
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    uvicorn.run("seed:app" if workers > 1 else app, host="0.0.0.0", port=8000, workers=workers)